@@ -7,7 +7,6 @@
 # Initially used oil companies, but oil market far too volatile for pairs trading.
 
 import numpy as np
-import statsmodels.api as sm
 import pandas as pd
 from zipline.utils import tradingcalendar
 import pytz
@@ -22,11 +21,13 @@ def initialize(context):
     set_symbol_lookup_date('2014-01-01')
     
     # Set stock pairs to be traded from research
+    # Baskets of 3+ stocks from the Johansen search are given as (stock_y, stock_x1, stock_x2, ...)
     context.stock_pairs = [(symbol('LPNT'), symbol('UHS'))]
     context.all_stocks=[]
     for pair in context.stock_pairs:
-        context.all_stocks.append(pair[0])
-        context.all_stocks.append(pair[1])
+        for stock in pair:
+            if stock not in context.all_stocks:
+                context.all_stocks.append(stock)
     
     context.num_pairs = len(context.stock_pairs)
     
@@ -38,6 +39,10 @@ def initialize(context):
     context.inLong = [False] * context.num_pairs
     context.inShort = [False] * context.num_pairs
     
+    # Target percent of every pair in every stock, summed per stock when ordering so that
+    # baskets sharing a stock don't overwrite each other's orders
+    context.targets = np.zeros((context.num_pairs, len(context.all_stocks)))
+    
     # Schedule checking pairs for 30 minutes every day before market close
     schedule_function(func=check_pair_status, date_rule=date_rules.every_day(), time_rule=time_rules.market_close(minutes=30))
         
@@ -47,101 +52,135 @@ def check_pair_status(context, data):
         return
     
     prices = data.history(context.all_stocks, 'price', 35, '1d').iloc[-context.lookback:]
-    new_spreads = np.ndarray((context.num_pairs, 1))
+    
+    # Spread weights of every pair over all stocks: 1 for stock_y and -hedge for each stock_x
+    weights = np.zeros((context.num_pairs, len(context.all_stocks)))
+    hedges = []
 
     for i in range(context.num_pairs):
         
         # Get the stocks from the pairs list
-        (stock_y, stock_x) = context.stock_pairs[i]
-        
-        # Get the pricing data
-        Y = prices[stock_y]
-        X = prices[stock_x]
+        stock_y = context.stock_pairs[i][0]
+        stocks_x = list(context.stock_pairs[i][1:])
         
-        # TRY to compute a hedge ratio
+        # TRY to compute a hedge ratio for each stock_x
         try:
-            hedge = hedge_ratio(Y, X, add_const=True)
+            hedge = hedge_ratio(prices[stock_y], prices[stocks_x], add_const=True)
         except ValueError as e:
             log.debug(e)
             return
         
-        # Calculate the spread based on the new hedge ratio
-        new_spreads[i, :] = Y[-1] - hedge * X[-1]
+        hedges.append(hedge)
+        weights[i, context.all_stocks.index(stock_y)] += 1
+        for (stock_x, h) in zip(stocks_x, hedge):
+            weights[i, context.all_stocks.index(stock_x)] -= h
+    
+    # Calculate the spreads of all pairs at once based on the new hedge ratios
+    new_spreads = weights.dot(prices.iloc[-1].values).reshape((context.num_pairs, 1))
+    
+    # If there is enough lookback in spreads
+    if context.spread.shape[-1] > context.z_window:
+        
+        # Keep only the z-score lookback period and use it to calculate the z-scores of all pairs
+        spreads = context.spread[:, -context.z_window:]
+        zscores = (spreads[:, -1] - spreads.mean(axis=1)) / spreads.std(axis=1)
         
-        # If there is enough lookback in spreads
-        if context.spread.shape[-1] > context.z_window:
-            
-            # Keep only the z-score lookback period and use it to calculate the z-score
-            spreads = context.spread[i, -context.z_window:]
-            zscore = (spreads[-1] - spreads.mean()) / spreads.std()
-            
-            # TRADING LOGIC:
-            
-            # When going short in the pair and the zscore goes negative, exit the position
-            if context.inShort[i] and zscore < 0.0 and all(data.can_trade([stock_x, stock_y])):
-                exit_pair(context, stock_x, stock_y, i)
-                return
-            # When going long in the pair and the zscore goes positive, exit the position
-            if context.inLong[i] and zscore > 0.0 and all(data.can_trade([stock_x, stock_y])):
-                exit_pair(context, stock_x, stock_y, i)
-                return
-            
-            # If zscore exceeds -1.0 and not already in a long position, enter the position
-            if zscore < -1.0 and (not context.inLong[i]) and all(data.can_trade([stock_x, stock_y])):
-                y_target_shares = 1
-                x_target_shares = hedge
-                context.inLong[i] = True
-                context.inShort[i] = False
-                
-                (y_target_pct, x_target_pct) = computeHoldingsPct(y_target_shares, x_target_shares, Y[-1], X[-1])
-                order_target_percent(stock_y, y_target_pct * (1.0/context.num_pairs) / float(context.num_pairs))
-                order_target_percent(stock_x, x_target_pct * (1.0/context.num_pairs) / float(context.num_pairs))
-                record(Y_pct=y_target_pct, X_pct=x_target_pct)
-                return
-            # If zscore exceeds 1.0 and not already in a short position, enter the position
-            if zscore > 1.0 and (not context.inShort[i]) and all(data.can_trade([stock_x, stock_y])):
-                y_target_shares = -1
-                x_target_shares = hedge
-                context.inLong[i] = False
-                context.inShort[i] = True
-                
-                (y_target_pct, x_target_pct) = computeHoldingsPct(y_target_shares, x_target_shares, Y[-1], X[-1])
-                order_target_percent(stock_y, y_target_pct * (1.0/context.num_pairs) / float(context.num_pairs))
-                order_target_percent(stock_x, x_target_pct * (1.0/context.num_pairs) / float(context.num_pairs))
-                record(Y_pct=y_target_pct, X_pct=x_target_pct)
-                return
+        previous_targets = context.targets.copy()
+        for i in range(context.num_pairs):
+            trade_pair(context, data, i, zscores[i], hedges[i], prices.iloc[-1])
+        
+        # One order per stock whose target changed, for the total of all pairs holding it
+        for j in np.flatnonzero((context.targets != previous_targets).any(axis=0)):
+            order_target_percent(context.all_stocks[j], context.targets[:, j].sum())
                 
     context.spread = np.hstack([context.spread, new_spreads])
+
+# Trading logic for one pair given its z-score
+def trade_pair(context, data, i, zscore, hedge, current_prices):
+    stocks = list(context.stock_pairs[i])
+    if not all(data.can_trade(stocks)):
+        return
+    
+    # When going short in the pair and the zscore goes negative, exit the position
+    if context.inShort[i] and zscore < 0.0:
+        exit_pair(context, stocks, i)
+    # When going long in the pair and the zscore goes positive, exit the position
+    elif context.inLong[i] and zscore > 0.0:
+        exit_pair(context, stocks, i)
+    # If zscore exceeds -1.0 and not already in a long position, enter the position
+    elif zscore < -1.0 and (not context.inLong[i]):
+        context.inLong[i] = True
+        context.inShort[i] = False
+        enter_pair(context, stocks, i, 1, hedge, current_prices)
+    # If zscore exceeds 1.0 and not already in a short position, enter the position
+    elif zscore > 1.0 and (not context.inShort[i]):
+        context.inLong[i] = False
+        context.inShort[i] = True
+        enter_pair(context, stocks, i, -1, hedge, current_prices)
+
+# Enter pair function (sets the pair's targets, check_pair_status places the orders)
+def enter_pair(context, stocks, i, y_target_shares, x_target_shares, current_prices):
+    (y_target_pct, x_target_pct) = computeHoldingsPct(y_target_shares, x_target_shares,
+                                                      current_prices[stocks[0]], current_prices[stocks[1:]].values)
+    context.targets[i, :] = 0
+    context.targets[i, context.all_stocks.index(stocks[0])] = y_target_pct * (1.0/context.num_pairs) / float(context.num_pairs)
+    for (stock_x, pct) in zip(stocks[1:], x_target_pct):
+        context.targets[i, context.all_stocks.index(stock_x)] = pct * (1.0/context.num_pairs) / float(context.num_pairs)
+    record(Y_pct=y_target_pct, X_pct=np.sum(x_target_pct))
+
+# Spread history the pairs need before they can trade, for local runs to checkpoint
+def checkpoint_state(context):
+    return {'pairs': np.array(pair_names(context)),
+            'spread': context.spread}
+
+# Restore the spread history from a checkpoint state saved with the same pairs, so trading
+# starts without the z_window warm-up. Positions are not restored, so every pair starts flat.
+def restore_state(context, state):
+    if list(state['pairs']) != pair_names(context):
+        raise ValueError('Checkpoint was saved for pairs ' + str(list(state['pairs'])))
+    
+    context.spread = state['spread']
+    context.inLong = [False] * context.num_pairs
+    context.inShort = [False] * context.num_pairs
+    context.targets[:] = 0
+
+# Names identifying the traded pairs in checkpoints
+def pair_names(context):
+    return ['/'.join(stock.symbol for stock in pair) for pair in context.stock_pairs]
           
-# Exit pair function
-def exit_pair(context, stock_x, stock_y, i):
-    order_target(stock_y, 0)
-    order_target(stock_x, 0)
+# Exit pair function (clears the pair's targets, check_pair_status places the orders)
+def exit_pair(context, stocks, i):
+    context.targets[i, :] = 0
     context.inShort[i] = False
     context.inLong[i] = False
     record(X_pct = 0, Y_pct = 0)
     return
 
-# Calculate hedge ratio
+# Calculate hedge ratio (one per column when X holds several stocks)
 def hedge_ratio(Y, X, add_const=True):
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
     
     # Only get the multiplier
     if add_const:
         
-        # Calculate hedge ratio by finding slope of linear regression
-        X = sm.add_constant(X)
-        model = sm.OLS(Y, X).fit()
-        return model.params[1]
+        # Calculate hedge ratio by finding slope of linear regression (closed form OLS)
+        X = np.column_stack([np.ones(len(X)), X])
+        return ols_params(Y, X)[1:]
     
     # Get both the multiplier and the intercept
-    model = sm.OLS(Y, X).fit()
-    return model.params.values
+    return ols_params(Y, X)
+
+# OLS coefficients from the normal equations
+def ols_params(Y, X):
+    return np.linalg.solve(X.T.dot(X), X.T.dot(np.asarray(Y, dtype=float)))
 
-# Compute the required holdings percents for each stock
+# Compute the required holdings percents for each stock (xShares and xPrice may be arrays)
 def computeHoldingsPct(yShares, xShares, yPrice, xPrice):
     yDol = yShares * yPrice
     xDol = xShares * xPrice
-    notionalDol = abs(yDol) + abs(xDol)
+    notionalDol = abs(yDol) + np.sum(np.abs(xDol))
     y_target_pct = yDol / notionalDol
     x_target_pct = xDol / notionalDol
     return (y_target_pct, x_target_pct)
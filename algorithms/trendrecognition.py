@@ -7,6 +7,7 @@
 # down trends are signified by lower highs & lows. Very bad predictive power so
 # has awful returns but was a good learning experience as my first original algo.
 import quantopian.algorithm as algo
+from collections import deque
 import pandas as pd
 import math
 from quantopian.pipeline import Pipeline
@@ -42,6 +43,8 @@ def initialize(context):
     context.sigmoid_mult = 0.75             # k-value for sigmoid function; higher values means high ratios valued less
     context.ddlookback = 252                # Look back a year when calculating drawdown volatility
     context.critpointsfilled = False        # Fill critical points to get dict started
+    context.minutemode = False              # Update trends on every minute bar instead of once a day
+    context.minuteseedbars = 390            # Seed minute mode critical points from the past trading day of bars
     
     # Dictionary holding the past 3 critical points and prices for each security
     context.past3critpoints = dict.fromkeys(context.secs, None)
@@ -50,11 +53,26 @@ def initialize(context):
     # Dictionary holding the trends of each security and its strength
     context.trendstrength = dict.fromkeys(context.secs, 0)
     
-    # Mock schedule because cannot call from init function, only happens once
-    schedule_function(initcritpoints, date_rules.every_day(), time_rules.market_open(minutes = 1))
+    # Minute mode state, updated incrementally so no history is fetched after warm-up
+    context.minutestatefilled = False
+    context.barcount = 0
+    # Dictionary holding the datetime and price of the previous bar of each security
+    context.lastbar = dict.fromkeys(context.secs, None)
+    # Dictionary holding (bar number, price) of the candidates for the rolling max of each security
+    context.ddwindow = dict((s, deque()) for s in context.secs)
+    # Dictionary holding the current drawdown from the rolling max of each security
+    context.drawdown = dict.fromkeys(context.secs, 0)
+    # Dictionary holding the price change into the previous bar of each security
+    context.lastchange = dict.fromkeys(context.secs, 0)
+    # Dictionary holding the critical points found so far of securities with fewer than 3
+    context.seedcritpoints = dict((s, []) for s in context.secs)
     
     # Schedule all functions in order: end pertinent trades, find trends, perform trades
-    schedule_function(trendanalysis, date_rules.every_day(), time_rules.market_open(minutes = 28))
+    # (in minute mode, critical points are seeded and trends updated in handle_data instead)
+    if not context.minutemode:
+        # Mock schedule because cannot call from init function, only happens once
+        schedule_function(initcritpoints, date_rules.every_day(), time_rules.market_open(minutes = 1))
+        schedule_function(trendanalysis, date_rules.every_day(), time_rules.market_open(minutes = 28))
     schedule_function(trade, date_rules.every_day(), time_rules.market_open(minutes = 30))
 
 # Calculate trend direction 
@@ -65,6 +83,11 @@ def trendanalysis(context, data):
     # Check most recent price point to determine trend
     for s in context.secs:
         
+        # Securities without 3 critical points yet are searched again instead of updated
+        if context.past3critpoints[s] is None:
+            findcritpoints(context, prices, s)
+            continue
+        
         # Calculate average drawdown volatility for past [context.lookback] days
         daily_drawdown = prices[s]/prices[s].rolling(context.lookback).max() - 1.0
         std_daily_drawdown = daily_drawdown.std()
@@ -72,48 +95,54 @@ def trendanalysis(context, data):
         # Update critical points
         updatecritpoints(context, data, prices, s)
         
-        # If prevous critical points go min-max-min, must be increasing
-        if (context.past3critpoints[s][0].values()[0] < context.past3critpoints[s][1].values()[0]) and (
-            context.past3critpoints[s][2].values()[0] < context.past3critpoints[s][1].values()[0]):
+        # Update trend strength with today's opening price
+        updatetrendstrength(context, s, prices[s][-1])
+
+# Update the trend strength of a security given its newest price
+def updatetrendstrength(context, s, price):
+    
+    # If prevous critical points go min-max-min, must be increasing
+    if (context.past3critpoints[s][0].values()[0] < context.past3critpoints[s][1].values()[0]) and (
+        context.past3critpoints[s][2].values()[0] < context.past3critpoints[s][1].values()[0]):
+            
+            # When new price exceeds previous maximum and trend is going up, record trend strength
+            if ((price > context.past3critpoints[s][1].values()[0]) and (
+                context.past3critpoints[s][2].values()[0] < context.past3critpoints[s][0].values()[0])):
                 
-                # When new price exceeds previous maximum and trend is going up, record trend strength
-                if ((prices[s][-1] > context.past3critpoints[s][1].values()[0]) and (
-                    context.past3critpoints[s][2].values()[0] < context.past3critpoints[s][0].values()[0])):
-                    
-                    # Trend strength metric is ratio of distance from 3 critpoints back to most recent critpoint 
-                    # and distance from two critpoints back to most recent critpoint
-                    context.trendstrength[s] = sigmoid_adjusted(context, (context.past3critpoints[s][0].values()[0] - context.past3critpoints[s][2].values()[0]) /
-                                                (context.past3critpoints[s][1].values()[0] - context.past3critpoints[s][0].values()[0]))
-                    
-                # If on a down trend and price exceeds previous maximum, set trend strength to 0
-                elif ((prices[s][-1] > context.past3critpoints[s][1].values()[0]) and (
-                    context.past3critpoints[s][2].values()[0] > context.past3critpoints[s][0].values()[0])):
-                    
-                    context.trendstrength[s] = 0
-        
-        # If prevous critical points go max-min-max, must be decreasing
-        elif (context.past3critpoints[s][0].values()[0] > context.past3critpoints[s][1].values()[0]) and (
-            context.past3critpoints[s][2].values()[0] > context.past3critpoints[s][1].values()[0]):
+                # Trend strength metric is ratio of distance from 3 critpoints back to most recent critpoint 
+                # and distance from two critpoints back to most recent critpoint
+                context.trendstrength[s] = sigmoid_adjusted(context, (context.past3critpoints[s][0].values()[0] - context.past3critpoints[s][2].values()[0]) /
+                                            (context.past3critpoints[s][1].values()[0] - context.past3critpoints[s][0].values()[0]))
                 
-                # When new price drops below previous minimum and trend is going down, record trend strength
-                if ((prices[s][-1] < context.past3critpoints[s][1].values()[0])and (
-                    context.past3critpoints[s][2].values()[0] > context.past3critpoints[s][0].values()[0])):
-                    
-                    # Trend strength metric is ratio of distance from 3 critpoints back to most recent critpoint 
-                    # and distance from two critpoints back to most recent critpoint
-                    # MULTIPLED BY -1 BECAUSE BOTH NEGATIVE VALUES WILL CANCEL OUT, THIS IS DOWN TREND THO
-                    context.trendstrength[s] = (-1) * sigmoid_adjusted(context, (context.past3critpoints[s][0].values()[0] - context.past3critpoints[s][2].values()[0]) /
-                                                       (context.past3critpoints[s][1].values()[0] - context.past3critpoints[s][0].values()[0]))
-        
-                # If on an up trend and price drops below previous minimum, set trend strength to 0
-                elif ((prices[s][-1] < context.past3critpoints[s][1].values()[0]) and (
-                    context.past3critpoints[s][2].values()[0] < context.past3critpoints[s][0].values()[0])):
-                    
-                    context.trendstrength[s] = 0
-                    
-        # If there is no identifiable trend and no trend is currently going, do not update trend
-        else:
-            continue
+            # If on a down trend and price exceeds previous maximum, set trend strength to 0
+            elif ((price > context.past3critpoints[s][1].values()[0]) and (
+                context.past3critpoints[s][2].values()[0] > context.past3critpoints[s][0].values()[0])):
+                
+                context.trendstrength[s] = 0
+    
+    # If prevous critical points go max-min-max, must be decreasing
+    elif (context.past3critpoints[s][0].values()[0] > context.past3critpoints[s][1].values()[0]) and (
+        context.past3critpoints[s][2].values()[0] > context.past3critpoints[s][1].values()[0]):
+            
+            # When new price drops below previous minimum and trend is going down, record trend strength
+            if ((price < context.past3critpoints[s][1].values()[0])and (
+                context.past3critpoints[s][2].values()[0] > context.past3critpoints[s][0].values()[0])):
+                
+                # Trend strength metric is ratio of distance from 3 critpoints back to most recent critpoint 
+                # and distance from two critpoints back to most recent critpoint
+                # MULTIPLED BY -1 BECAUSE BOTH NEGATIVE VALUES WILL CANCEL OUT, THIS IS DOWN TREND THO
+                context.trendstrength[s] = (-1) * sigmoid_adjusted(context, (context.past3critpoints[s][0].values()[0] - context.past3critpoints[s][2].values()[0]) /
+                                                   (context.past3critpoints[s][1].values()[0] - context.past3critpoints[s][0].values()[0]))
+    
+            # If on an up trend and price drops below previous minimum, set trend strength to 0
+            elif ((price < context.past3critpoints[s][1].values()[0]) and (
+                context.past3critpoints[s][2].values()[0] < context.past3critpoints[s][0].values()[0])):
+                
+                context.trendstrength[s] = 0
+                
+    # If there is no identifiable trend and no trend is currently going, do not update trend
+    else:
+        return
          
 # Execute trades
 def trade(context, data):
@@ -152,15 +181,19 @@ def sigmoid_adjusted(context, t):
     
 # Update moving critical point array (called every day in trendanalysis)
 def updatecritpoints(context, data, prices, s):
+    checkcritpoint(context, s, prices.index[-2], prices[s][-2], prices[s][-1])
+
+# Add the previous bar as a critical point if the trend turned on it
+def checkcritpoint(context, s, prevdate, prevprice, price):
     
     # If prevous critical points go min-max-min, must be increasing
     if (context.past3critpoints[s][0].values()[0] < context.past3critpoints[s][1].values()[0]) and (
             context.past3critpoints[s][2].values()[0] < context.past3critpoints[s][1].values()[0]):
         
         # Detect new maximums
-        if prices[s][-2] > prices[s][-1]:
+        if prevprice > price:
             context.past3critpoints.update({
-               s: [{prices.index[-2]: prices[s][-2]},
+               s: [{prevdate: prevprice},
                    context.past3critpoints[s][0],
                    context.past3critpoints[s][1]]
                })
@@ -170,12 +203,89 @@ def updatecritpoints(context, data, prices, s):
         context.past3critpoints[s][2].values()[0] > context.past3critpoints[s][1].values()[0]):
         
         # Detect new minimums
-        if prices[s][-2] < prices[s][-1]:
+        if prevprice < price:
             context.past3critpoints.update({
-               s: [{prices.index[-2]: prices[s][-2]},
+               s: [{prevdate: prevprice},
                    context.past3critpoints[s][0],
                    context.past3critpoints[s][1]]
                })
+
+# Minute mode: feed each new bar into the critical points, rolling drawdown and trend strength
+# of every security, without fetching any history after warm-up
+def handle_data(context, data):
+    if not context.minutemode:
+        return
+    if not context.minutestatefilled:
+        initminutestate(context, data)
+    
+    context.barcount += 1
+    now = get_datetime()
+    current = data.current(context.secs, 'price')
+    
+    for s in context.secs:
+        price = current[s]
+        if math.isnan(price):
+            continue
+        
+        updatedrawdown(context, s, price)
+        (prevdate, prevprice) = context.lastbar[s]
+        if context.past3critpoints[s] is None:
+            seedcritpoint(context, s, prevdate, prevprice, price)
+        else:
+            checkcritpoint(context, s, prevdate, prevprice, price)
+            updatetrendstrength(context, s, price)
+        context.lastchange[s] = price - prevprice
+        context.lastbar[s] = (now, price)
+
+# Collect the critical points of a security that had fewer than 3 in its seed window, one bar
+# at a time, until it has the 3 that trend tracking needs
+def seedcritpoint(context, s, prevdate, prevprice, price):
+    change = context.lastchange[s]
+    if (change > 0 and price < prevprice) or (change < 0 and price > prevprice):
+        context.seedcritpoints[s] = [{prevdate: prevprice}] + context.seedcritpoints[s][:2]
+        if len(context.seedcritpoints[s]) == 3:
+            context.past3critpoints[s] = context.seedcritpoints[s]
+
+# Update the rolling max over the past [context.lookback] bars and the drawdown from it
+def updatedrawdown(context, s, price):
+    window = context.ddwindow[s]
+    
+    # Prices below the new price can never be the max again
+    while window and window[-1][1] <= price:
+        window.pop()
+    window.append((context.barcount, price))
+    
+    # Drop the max once it is older than the lookback
+    while window[0][0] <= context.barcount - context.lookback:
+        window.popleft()
+    context.drawdown[s] = price / window[0][1] - 1.0
+
+# Warm up minute mode state with the only history fetch it needs
+def initminutestate(context, data):
+    # Every bar but the current one, which handle_data feeds in itself
+    bars = max(context.minuteseedbars, context.lookback)
+    prices = data.history(context.secs, 'price', bars + 1, '1m')[:-1]
+    
+    # Seed the critical points from the same minute bars (securities with fewer than 3, e.g.
+    # thinly traded ones, collect the rest in handle_data)
+    for s in context.secs:
+        context.seedcritpoints[s] = findcritpoints(context, prices, s)
+    context.critpointsfilled = True
+    
+    # The rolling max only needs the past [context.lookback] bars
+    recent = prices.iloc[-context.lookback:]
+    for s in context.secs:
+        context.ddwindow[s].clear()
+    for i in range(len(recent)):
+        context.barcount = i + 1
+        for s in context.secs:
+            if not math.isnan(recent[s].iloc[i]):
+                updatedrawdown(context, s, recent[s].iloc[i])
+    for s in context.secs:
+        context.lastbar[s] = (prices.index[-1], prices[s].iloc[-1])
+        context.lastchange[s] = prices[s].iloc[-1] - prices[s].iloc[-2]
+    
+    context.minutestatefilled = True
         
 # Initialize moving critical point array
 def initcritpoints(context, data):
@@ -187,25 +297,29 @@ def initcritpoints(context, data):
     
     # Find highs and lows for each stock
     for s in context.secs:
-        
-        # Placeholder array for determining critical points
-        allcritpoints = []
-
-        for date in prices[1:-1].index:
-            # Checking for maximums and minimums (critical points)
-            if ((prices[s][date] < prices[s].iloc[prices[s].index.get_loc(date) - 1]) and (
-                prices[s].iloc[prices[s].index.get_loc(date) - 2] < prices[s].iloc[prices[s].index.get_loc(date) - 1])) or (
-                (prices[s][date] > prices[s].iloc[prices[s].index.get_loc(date) - 1]) and (
-                prices[s].iloc[prices[s].index.get_loc(date) - 2] > prices[s].iloc[prices[s].index.get_loc(date) - 1])):
-                    
-                    # Add any found critical points
-                    allcritpoints.append(prices.index[prices[s].index.get_loc(date)-1])
-   
-        # Add most recent 3 critical points to [context.past3critpoints]
-        context.past3critpoints.update({
-               s: [{allcritpoints[-1]: prices[s][allcritpoints[-1]]},
-                   {allcritpoints[-2]: prices[s][allcritpoints[-2]]},
-                   {allcritpoints[-3]: prices[s][allcritpoints[-3]]}]
-               })                
+        findcritpoints(context, prices, s)
             
     context.critpointsfilled = True
+
+# Set the most recent 3 critical points of a security from its price history. A security with
+# fewer than 3 is left unset. Returns the (up to 3) most recent critical points, newest first.
+def findcritpoints(context, prices, s):
+    
+    # Placeholder array for determining critical points
+    allcritpoints = []
+
+    for date in prices[1:-1].index:
+        # Checking for maximums and minimums (critical points)
+        if ((prices[s][date] < prices[s].iloc[prices[s].index.get_loc(date) - 1]) and (
+            prices[s].iloc[prices[s].index.get_loc(date) - 2] < prices[s].iloc[prices[s].index.get_loc(date) - 1])) or (
+            (prices[s][date] > prices[s].iloc[prices[s].index.get_loc(date) - 1]) and (
+            prices[s].iloc[prices[s].index.get_loc(date) - 2] > prices[s].iloc[prices[s].index.get_loc(date) - 1])):
+                
+                # Add any found critical points
+                allcritpoints.append(prices.index[prices[s].index.get_loc(date)-1])
+   
+    # Add most recent 3 critical points to [context.past3critpoints]
+    critpoints = [{date: prices[s][date]} for date in allcritpoints[::-1][:3]]
+    if len(critpoints) == 3:
+        context.past3critpoints.update({s: critpoints})
+    return critpoints
@@ -0,0 +1,84 @@
+# Imports
+import os
+import numpy as np
+import pandas as pd
+
+# Local runs
+
+# Checkpoints of algorithm context state for local zipline backtests. Algorithms do no file I/O
+# themselves (the platform doesn't allow it). Instead an algorithm exposes
+# checkpoint_state(context), returning a dict of NumPy arrays, and restore_state(context, state)
+# (pairstrading_hedgeratio.py does, for its spread history). This file writes those states as
+# compressed .npz files on chosen dates and restores one at the start of a run, so
+# overlapping-window and walk-forward backtests skip the warm-up days.
+
+# Select the algorithm, the backtest data and the checkpoint location
+algorithm_path = os.path.join('..', 'algorithms', 'pairstrading_hedgeratio.py')
+bundle = 'quandl'
+capital_base = 100000
+checkpoint_dir = 'checkpoints'
+
+# Loads an algorithm file for a local run. Algorithms use the backtester's API without importing
+# it (set_slippage, symbol, schedule_function, ...), so the file is executed in a namespace that
+# already holds everything zipline.api exports, plus a logger for the log.debug() calls.
+# Returns the namespace, holding initialize and the algorithm's other functions.
+def load_algorithm(path):
+    import logbook
+    import zipline.api
+
+    namespace = dict((name, getattr(zipline.api, name)) for name in dir(zipline.api) if not name.startswith('_'))
+    namespace['log'] = logbook.Logger(os.path.basename(path))
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), namespace)
+    return namespace
+
+# Writes a checkpoint state
+def save_checkpoint(path, state):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    np.savez_compressed(path, **state)
+
+# Reads a checkpoint state written by save_checkpoint
+def load_checkpoint(path):
+    checkpoint = np.load(path)
+    return dict((key, checkpoint[key]) for key in checkpoint.files)
+
+# Wraps an algorithm's initialize so that the run restores [warmstart_file] (if given) and
+# saves a checkpoint after the close of each of [checkpoint_dates] ('YYYY-MM-DD'), named
+# [name]_YYYY-MM-DD.npz. Pass the result as initialize to zipline's run_algorithm.
+def with_checkpoints(initialize, checkpoint_state, restore_state, name, checkpoint_dates=(),
+                     checkpoint_dir=checkpoint_dir, warmstart_file=None):
+    from zipline.api import date_rules, get_datetime, schedule_function, time_rules
+
+    def save(context, data):
+        date = get_datetime().strftime('%Y-%m-%d')
+        if date in checkpoint_dates:
+            save_checkpoint(os.path.join(checkpoint_dir, name + '_' + date + '.npz'), checkpoint_state(context))
+
+    def initialize_with_checkpoints(context):
+        initialize(context)
+        if warmstart_file:
+            restore_state(context, load_checkpoint(warmstart_file))
+        schedule_function(save, date_rules.every_day(), time_rules.market_close())
+
+    return initialize_with_checkpoints
+
+if __name__ == '__main__':
+    from zipline import run_algorithm
+
+    algorithm = load_algorithm(algorithm_path)
+
+    # Runs the algorithm between two dates with checkpointing
+    def run(start, end, **kwargs):
+        initialize = with_checkpoints(algorithm['initialize'], algorithm['checkpoint_state'],
+                                      algorithm['restore_state'], 'pairstrading', **kwargs)
+        return run_algorithm(start=pd.Timestamp(start, tz='utc'), end=pd.Timestamp(end, tz='utc'),
+                             initialize=initialize, capital_base=capital_base, bundle=bundle)
+
+    # Save the state at the end of the first half of 2015, then start the second half from it
+    # instead of replaying the warm-up
+    first_half = run('2015-01-02', '2015-06-30', checkpoint_dates=['2015-06-30'])
+    second_half = run('2015-07-01', '2015-12-31',
+                      warmstart_file=os.path.join(checkpoint_dir, 'pairstrading_2015-06-30.npz'))
+    print(second_half['portfolio_value'].tail())
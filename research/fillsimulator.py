@@ -0,0 +1,110 @@
+# Imports
+import numpy as np
+
+# Research environment
+
+# Vectorized fill and cost simulation for local backtests. Every order placed in a bar
+# is filled in one pass against that bar's price and volume arrays, using the same
+# slippage and commission models the algorithms configure with set_slippage() and
+# set_commission() (e.g. FixedSlippage(spread=0) and PerTrade(cost=1) in pairstrading_hedgeratio).
+
+# Slippage models, same arguments and defaults as the backtester's
+class FixedSlippage(object):
+    def __init__(self, spread=0.0):
+        self.spread = spread
+
+class VolumeShareSlippage(object):
+    def __init__(self, volume_limit=0.025, price_impact=0.1):
+        self.volume_limit = volume_limit
+        self.price_impact = price_impact
+
+# Commission models, same arguments and defaults as the backtester's
+class PerTrade(object):
+    def __init__(self, cost=0.0):
+        self.cost = cost
+
+class PerShare(object):
+    def __init__(self, cost=0.001, min_trade_cost=0.0):
+        self.cost = cost
+        self.min_trade_cost = min_trade_cost
+
+# Fills every order of one bar and updates [positions] and [cash] (a 1-element array) in place.
+# [order_assets] are the column of each order's asset in the [prices], [volumes] and [positions]
+# arrays, and [order_amounts] the signed number of shares ordered. Returns the filled amounts,
+# fill prices and commissions of each order.
+def simulate_fills(order_assets, order_amounts, prices, volumes, positions, cash,
+                   slippage_model=None, commission_model=None):
+    if slippage_model is None:
+        slippage_model = VolumeShareSlippage()
+    if commission_model is None:
+        commission_model = PerShare()
+
+    order_assets = np.asarray(order_assets, dtype=np.int64)
+    order_amounts = np.asarray(order_amounts, dtype=np.float64)
+    direction = np.sign(order_amounts)
+    bar_prices = prices[order_assets]
+    bar_volumes = volumes[order_assets]
+
+    # Only assets that traded in this bar can fill
+    tradeable = (bar_volumes > 0) & np.isfinite(bar_prices)
+
+    if isinstance(slippage_model, FixedSlippage):
+        filled = np.where(tradeable, order_amounts, 0.0)
+        fill_prices = bar_prices + direction * (slippage_model.spread / 2.0)
+
+    elif isinstance(slippage_model, VolumeShareSlippage):
+        # Orders for the same asset share its volume limit in the order they were placed
+        order = np.argsort(order_assets, kind='mergesort')
+        sorted_assets = order_assets[order]
+        sorted_amounts = np.abs(order_amounts[order])
+        group_start = np.r_[True, sorted_assets[1:] != sorted_assets[:-1]]
+        cumulative = np.cumsum(sorted_amounts)
+        group_offset = np.maximum.accumulate(np.where(group_start, cumulative - sorted_amounts, 0))
+        previously_ordered = np.empty_like(sorted_amounts)
+        previously_ordered[order] = cumulative - sorted_amounts - group_offset
+
+        # Fill up to the shares left under [volume_limit] of the bar's volume
+        max_volume = np.floor(slippage_model.volume_limit * bar_volumes)
+        remaining = np.maximum(max_volume - previously_ordered, 0)
+        filled = np.where(tradeable, direction * np.minimum(np.abs(order_amounts), remaining), 0.0)
+
+        # Price impact grows with the square of the asset's share of the bar's volume
+        previously_filled = np.minimum(previously_ordered, max_volume)
+        volume_share = np.where(tradeable, (previously_filled + np.abs(filled)) / np.where(tradeable, bar_volumes, 1), 0)
+        volume_share = np.minimum(volume_share, slippage_model.volume_limit)
+        fill_prices = bar_prices * (1 + direction * slippage_model.price_impact * volume_share ** 2)
+
+    else:
+        raise ValueError('Unsupported slippage model: ' + type(slippage_model).__name__)
+
+    traded = filled != 0
+    if isinstance(commission_model, PerTrade):
+        commissions = np.where(traded, commission_model.cost, 0.0)
+    elif isinstance(commission_model, PerShare):
+        commissions = np.where(traded, np.maximum(np.abs(filled) * commission_model.cost,
+                                                  commission_model.min_trade_cost), 0.0)
+    else:
+        raise ValueError('Unsupported commission model: ' + type(commission_model).__name__)
+
+    # Apply the fills to the portfolio
+    np.add.at(positions, order_assets, filled)
+    cash -= np.dot(filled, np.where(traded, fill_prices, 0.0)) + commissions.sum()
+
+    return filled, fill_prices, commissions
+
+if __name__ == '__main__':
+    import time
+
+    # Fill a rebalance touching every name of a 5000 asset universe
+    n = 5000
+    prices = np.random.uniform(10, 200, n)
+    volumes = np.random.randint(0, 1000000, n).astype(np.float64)
+    positions = np.zeros(n)
+    cash = np.array([1e7])
+    order_assets = np.random.randint(0, n, 2 * n)
+    order_amounts = np.random.randint(-5000, 5000, 2 * n)
+
+    start = time.time()
+    simulate_fills(order_assets, order_amounts, prices, volumes, positions, cash,
+                   VolumeShareSlippage(), PerShare())
+    print("Filled " + str(len(order_assets)) + " orders in " + str(time.time() - start) + "s, cash: $" + str(cash[0]))
@@ -0,0 +1,202 @@
+# Imports
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Research environment
+
+# Whole-history vectorized version of check_pair_status in pairstrading_hedgeratio.py, for
+# comparing many pair candidates and parameters at once. Each pair is evaluated as if it were
+# the only pair traded, orders fill at the day's price, and the equity starts at 1.0.
+
+# Select a time range and the (stock_y, stock_x) pairs to evaluate
+start_date = '2014-01-01'
+end_date = '2016-01-01'
+stock_pairs = [('LPNT', 'UHS'), ('XOM', 'CVX'), ('COP', 'MRO')]
+lookbacks = [10, 20, 30]
+z_windows = [10, 15, 20]
+
+# Days of prices check_pair_status fetches, which caps the lookback it can use
+history_days = 35
+
+# Algorithm used for the event-driven cross-check, relative to the research directory
+algorithm_path = os.path.join('..', 'algorithms', 'pairstrading_hedgeratio.py')
+
+# Sums over the trailing [window] rows of every column, NaN until a full window is available
+# and wherever the window holds a NaN (so a missing price only affects the windows it is in)
+def rolling_sum(a, window):
+    missing = np.isnan(a)
+    c = np.cumsum(np.where(missing, 0.0, a), axis=0)
+    m = np.cumsum(missing, axis=0)
+    sums = np.full(a.shape, np.nan)
+    sums[window-1] = c[window-1]
+    sums[window:] = c[window:] - c[:-window]
+    missing_in_window = np.ones(a.shape, dtype=bool)
+    missing_in_window[window-1] = m[window-1] > 0
+    missing_in_window[window:] = (m[window:] - m[:-window]) > 0
+    sums[missing_in_window] = np.nan
+    return sums
+
+# Forward fills every column, used to mark positions to the last known price
+def forward_fill(a):
+    rows = np.where(np.isnan(a), 0, np.arange(len(a))[:, None])
+    return a[np.maximum.accumulate(rows, axis=0), np.arange(a.shape[1])]
+
+# Hedge ratios (slope of the OLS regression of Y on X with a constant) over the trailing
+# [lookback] days, for every day and every column
+def rolling_hedge_ratios(Y, X, lookback):
+    # Slopes don't change when a constant is removed, and centering keeps the sums small
+    Y = Y - np.nanmean(Y, axis=0)
+    X = X - np.nanmean(X, axis=0)
+    sx = rolling_sum(X, lookback)
+    sy = rolling_sum(Y, lookback)
+    sxx = rolling_sum(X * X, lookback)
+    sxy = rolling_sum(X * Y, lookback)
+    return (lookback * sxy - sx * sy) / (lookback * sxx - sx * sx)
+
+# Z-score used on each day: yesterday's spread against the [z_window] spreads before today.
+# As in the algorithm, there must be more than [z_window] spreads before today.
+def rolling_zscores(spreads, first_day, z_window):
+    valid = spreads[first_day:]
+    centered = valid - np.nanmean(valid, axis=0)
+    mean = rolling_sum(centered, z_window) / z_window
+    variance = np.maximum(rolling_sum(centered * centered, z_window) / z_window - mean * mean, 0)
+    zscores = np.full(spreads.shape, np.nan)
+
+    # Statistics of the window ending yesterday are used today
+    zscores[first_day + z_window + 1:] = ((centered - mean) / np.sqrt(variance))[z_window:-1]
+    return zscores
+
+# Runs the entry/exit state machine over all columns at once. Returns the equity curves and
+# the number of entries of each column.
+def run_state_machine(Y, X, hedges, zscores):
+    days, columns = Y.shape
+    state = np.zeros(columns)             # 1 when long the spread, -1 when short
+    y_shares = np.zeros(columns)
+    x_shares = np.zeros(columns)
+    value = np.ones(columns)
+    equity = np.ones((days, columns))
+    entries = np.zeros(columns, dtype=np.int64)
+
+    # Positions are marked to the last known price, so a missing price doesn't lose the move
+    # (before a stock's first price no position can be held, so those changes are 0)
+    Y_changes = np.nan_to_num(np.diff(forward_fill(Y), axis=0))
+    X_changes = np.nan_to_num(np.diff(forward_fill(X), axis=0))
+
+    for t in range(1, days):
+        value = value + y_shares * Y_changes[t-1] + x_shares * X_changes[t-1]
+        z = zscores[t]
+
+        # Nothing is traded on a day without prices or a hedge ratio
+        tradeable = np.isfinite(Y[t]) & np.isfinite(X[t]) & np.isfinite(hedges[t])
+
+        # Exits are checked first, so a position never flips sides on the same day
+        with np.errstate(invalid='ignore'):
+            exiting = tradeable & (((state == -1) & (z < 0.0)) | ((state == 1) & (z > 0.0)))
+            enter_long = tradeable & ~exiting & (z < -1.0) & (state != 1)
+            enter_short = tradeable & ~exiting & ~enter_long & (z > 1.0) & (state != -1)
+
+        # computeHoldingsPct sizing of 1 share of Y against [hedge] shares of X
+        y_target = np.where(enter_long, 1.0, -1.0)
+        notional = np.abs(y_target * Y[t]) + np.abs(hedges[t] * X[t])
+        entering = enter_long | enter_short
+        y_shares = np.where(entering, y_target * value / notional, np.where(exiting, 0.0, y_shares))
+        x_shares = np.where(entering, hedges[t] * value / notional, np.where(exiting, 0.0, x_shares))
+        state = np.where(enter_long, 1, np.where(enter_short, -1, np.where(exiting, 0, state)))
+        entries += entering
+        equity[t] = value
+
+    return equity, entries
+
+# Evaluates every (pair, lookback, z_window) combination over the whole history in a single
+# pass of the state machine. [prices] holds one column per stock. Returns one row per combination.
+def vectorized_backtest(prices, stock_pairs, lookbacks, z_windows):
+    if max(lookbacks) > history_days:
+        raise ValueError('check_pair_status only fetches ' + str(history_days) + ' days of prices, '
+                         'lookbacks above that are not supported: ' + str(lookbacks))
+
+    Y = prices[[pair[0] for pair in stock_pairs]].values.astype(np.float64)
+    X = prices[[pair[1] for pair in stock_pairs]].values.astype(np.float64)
+
+    # Rolling statistics of every parameter combination, stacked along the columns
+    all_hedges, all_zscores, combinations = [], [], []
+    for lookback in lookbacks:
+        hedges = rolling_hedge_ratios(Y, X, lookback)
+        spreads = Y - hedges * X
+        for z_window in z_windows:
+            all_hedges.append(hedges)
+            all_zscores.append(rolling_zscores(spreads, lookback - 1, z_window))
+            combinations += [(pair[0], pair[1], lookback, z_window) for pair in stock_pairs]
+
+    copies = len(all_hedges)
+    equity, entries = run_state_machine(np.tile(Y, copies), np.tile(X, copies),
+                                        np.hstack(all_hedges), np.hstack(all_zscores))
+
+    results = pd.DataFrame(combinations, columns=['stock_y', 'stock_x', 'lookback', 'z_window'])
+    results['total_return'] = equity[-1] - 1.0
+    results['entries'] = entries
+    return results, equity
+
+# Runs check_pair_status from the algorithm itself day by day, with a minimal stand-in for the
+# backtester API, and returns its equity curve for cross-checking the vectorized backtest.
+def event_driven_backtest(prices, stock_y, stock_x, lookback=20, z_window=20):
+    namespace = {}
+    with open(algorithm_path) as f:
+        exec(compile(f.read(), algorithm_path, 'exec'), namespace)
+
+    portfolio = {'day': 0, 'value': 1.0, 'shares': {stock_y: 0.0, stock_x: 0.0}}
+
+    def order_target_percent(stock, percent):
+        portfolio['shares'][stock] = percent * portfolio['value'] / prices[stock].iloc[portfolio['day']]
+
+    class Data(object):
+        def history(self, assets, field, bar_count, frequency):
+            return prices[assets].iloc[max(0, portfolio['day'] - bar_count + 1):portfolio['day'] + 1]
+        def can_trade(self, assets):
+            return [True] * len(assets)
+
+    class Context(object):
+        pass
+
+    # Same strategy variables as initialize(), for the single pair
+    context = Context()
+    context.stock_pairs = [(stock_y, stock_x)]
+    context.all_stocks = [stock_y, stock_x]
+    context.num_pairs = 1
+    context.lookback = lookback
+    context.z_window = z_window
+    context.spread = np.ndarray((1, 0))
+    context.inLong = [False]
+    context.inShort = [False]
+    context.targets = np.zeros((1, 2))
+
+    namespace.update(get_open_orders=lambda: {}, order_target_percent=order_target_percent,
+                     record=lambda **kwargs: None)
+
+    data = Data()
+    equity = np.ones(len(prices))
+    for day in range(1, len(prices)):
+        portfolio['day'] = day
+        portfolio['value'] += sum(shares * (prices[stock].iloc[day] - prices[stock].iloc[day - 1])
+                                  for stock, shares in portfolio['shares'].items())
+        if day >= lookback - 1:
+            namespace['check_pair_status'](context, data)
+        equity[day] = portfolio['value']
+    return equity
+
+if __name__ == '__main__':
+    symbol_list = sorted(set(stock for pair in stock_pairs for stock in pair))
+    prices = get_pricing(symbol_list, fields='price', start_date=start_date, end_date=end_date)
+    prices.columns = [stock.symbol for stock in prices.columns]
+
+    # Evaluate every pair/parameter combination
+    start = time.time()
+    results, equity = vectorized_backtest(prices, stock_pairs, lookbacks, z_windows)
+    elapsed = time.time() - start
+    print(results.sort_values('total_return', ascending=False))
+    print(str(len(results) / elapsed) + " combinations per second")
+
+    # Cross-check the first pair against the event-driven algorithm
+    event_equity = event_driven_backtest(prices, stock_pairs[0][0], stock_pairs[0][1], lookbacks[0], z_windows[0])
+    print("Matches event-driven backtest: " + str(np.allclose(event_equity, equity[:, 0])))
@@ -0,0 +1,93 @@
+# Headless pair scan
+#
+# Command line version of the pairs research for nightly scans, run on price CSVs
+# (dates as rows, symbols as columns). Only numpy and pandas are imported at startup;
+# statsmodels is imported when a scan runs and seaborn only when a plot is requested.
+#
+#   python pairscan.py scan prices.csv [--sectors sectors.csv] [--top-k 3] [--plot pvalues.png]
+#   python pairscan.py hedge prices.csv Y X [X2 ...] [--lookback 20]
+from __future__ import print_function
+
+# Started before any other import so startup time includes every import
+import time
+startup_began = time.time()
+
+import argparse
+import sys
+
+import pandas as pd
+
+from pairstrading import (find_candidate_pairs, find_cointegrated_pairs, ols_hedge_ratio,
+                          plot_pvalues, top_candidates)
+
+# Seconds the imports are allowed to take before a warning is printed
+startup_budget = 1.0
+
+# Tests the candidate pairs for cointegration and prints the significant ones with their hedge ratios
+def scan(args):
+    securities_prices = pd.read_csv(args.prices, index_col=0, parse_dates=True)
+    sectors = None
+    if args.sectors:
+        sectors = pd.read_csv(args.sectors, index_col=0).iloc[:, 0].to_dict()
+
+    candidate_pairs = find_candidate_pairs(securities_prices, sectors=sectors, top_k=args.top_k)
+    scores, pvalues, pairs = find_cointegrated_pairs(securities_prices, candidates=candidate_pairs)
+
+    print('stock_y,stock_x,pvalue,hedge,intercept')
+    for (i, j) in candidate_pairs:
+        if pvalues[i, j] < 0.05:
+            Y = securities_prices.iloc[:, i]
+            X = securities_prices.iloc[:, j]
+            hedge, intercept = ols_hedge_ratio(Y, X)
+            print(','.join([Y.name, X.name, str(pvalues[i, j]), str(hedge[0]), str(intercept)]))
+
+    if args.plot:
+        import matplotlib
+        matplotlib.use('Agg')
+        plot_pvalues(pvalues, list(securities_prices.columns)).get_figure().savefig(args.plot)
+
+# Prints the hedge ratios and intercept of stock_y against the stock_x's over the lookback
+def hedge(args):
+    securities_prices = pd.read_csv(args.prices, index_col=0, parse_dates=True).iloc[-args.lookback:]
+    hedges, intercept = ols_hedge_ratio(securities_prices[args.stock_y], securities_prices[args.stock_x])
+
+    print('stock,hedge')
+    for (stock_x, h) in zip(args.stock_x, hedges):
+        print(stock_x + ',' + str(h))
+    print('intercept,' + str(intercept))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless pairs trading research.')
+    parser.add_argument('--startup-budget', type=float, default=startup_budget,
+                        help='seconds of import time allowed before warning')
+    subparsers = parser.add_subparsers(dest='command')
+
+    scan_parser = subparsers.add_parser('scan', help='find cointegrated pairs')
+    scan_parser.add_argument('prices', help='CSV of prices, dates as rows and symbols as columns')
+    scan_parser.add_argument('--sectors', help='CSV of symbol,sector used to bucket candidates')
+    scan_parser.add_argument('--top-k', type=int, default=top_candidates,
+                             help='most correlated securities per security to test')
+    scan_parser.add_argument('--plot', help='save a heatmap of the p-values to this file')
+    scan_parser.set_defaults(run=scan)
+
+    hedge_parser = subparsers.add_parser('hedge', help='compute hedge ratios')
+    hedge_parser.add_argument('prices', help='CSV of prices, dates as rows and symbols as columns')
+    hedge_parser.add_argument('stock_y')
+    hedge_parser.add_argument('stock_x', nargs='+')
+    hedge_parser.add_argument('--lookback', type=int, default=20, help='days used for the regression')
+    hedge_parser.set_defaults(run=hedge)
+
+    args = parser.parse_args(argv)
+    if not getattr(args, 'run', None):
+        parser.error('a command is required')
+
+    # Report the import time so a slow import shows up in the cron logs
+    startup = time.time() - startup_began
+    print('Startup took %.3fs' % startup, file=sys.stderr)
+    if startup > args.startup_budget:
+        print('Warning: startup exceeded the %.3fs budget' % args.startup_budget, file=sys.stderr)
+
+    args.run(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,241 @@
 # Imports
+from itertools import combinations
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
 
-import statsmodels
-from statsmodels.tsa.stattools import coint
-import seaborn
-
-import matplotlib.pyplot as plt
+# statsmodels and seaborn are imported where they are used, so scripts that only need
+# part of this file (e.g. pairscan.py computing hedge ratios) start quickly
 
 # Set starting date and ending date
 start_date = '2014-01-01'
 end_date = '2015-01-01'
 
-# Finds cointegrated pairs from given array of securities pricings
-def find_cointegrated_pairs(securities_panel):
-    n = len(securities_panel.minor_axis)
+# Number of most correlated securities per security passed on to the cointegration test
+top_candidates = 3
+
+# Also run the exhaustive scan to report the prefilter's recall (slow, only for tuning [top_candidates])
+check_recall = False
+
+# Number of securities per basket for the Johansen basket search
+basket_size = 3
+
+# 95% critical values of the Johansen trace statistic (constant term), by number of
+# securities minus the tested cointegration rank
+johansen_trace_critical_values = {1: 3.8415, 2: 15.4943, 3: 29.7961, 4: 47.8545,
+                                  5: 69.8189, 6: 95.7542}
+
+# Finds cointegrated pairs from given dataframe of securities pricings
+def find_cointegrated_pairs(securities_prices, candidates=None):
+    from statsmodels.tsa.stattools import coint
+    
+    n = len(securities_prices.columns)
     score_matrix = np.zeros((n, n))
     pvalue_matrix = np.ones((n, n))
-    keys = securities_panel.keys
     pairs = []
     
-    # Cycles through all combinations of two securities and checks cointegration on each
-    for i in range(n):
-        for j in range(i+1, n):
-            S1 = securities_panel.minor_xs(securities_panel.minor_axis[i])
-            S2 = securities_panel.minor_xs(securities_panel.minor_axis[j])
-            result = coint(S1, S2)
-            score = result[0]
-            pvalue = result[1]
-            score_matrix[i, j] = score
-            pvalue_matrix[i, j] = pvalue
-            
-            # Returns statistically significant pairs
-            if pvalue < 0.05:
-                pairs.append((securities_panel.minor_axis[i], securities_panel.minor_axis[j]))
+    # Without a prefilter, cycles through all combinations of two securities
+    if candidates is None:
+        candidates = [(i, j) for i in range(n) for j in range(i+1, n)]
+    
+    # Checks cointegration on each candidate pair
+    for (i, j) in candidates:
+        S1 = securities_prices.iloc[:, i]
+        S2 = securities_prices.iloc[:, j]
+        result = coint(S1, S2)
+        score = result[0]
+        pvalue = result[1]
+        score_matrix[i, j] = score
+        pvalue_matrix[i, j] = pvalue
+        
+        # Returns statistically significant pairs
+        if pvalue < 0.05:
+            pairs.append((securities_prices.columns[i], securities_prices.columns[j]))
                 
     return score_matrix, pvalue_matrix, pairs
+
+# Finds the [top_k] most correlated securities of each security, so that obviously
+# unrelated securities never reach the expensive cointegration tests
+def find_neighbours(securities_prices, sectors=None, top_k=top_candidates):
+    n = len(securities_prices.columns)
     
-# Create symbols array of oil companies and the S&P 500
-symbol_list = ['XOM', 'BP', 'RDS-B', 'COP', 'MRO', 'PXD', 'STO', 'PZE', 'SHI', 'COG', 'CLR', 'CRZO', 'SPY']
-securities_panel = get_pricing(symbol_list, fields=['price'], start_date=start_date, end_date=end_date)
-securities_panel.minor_axis = map(lambda x: x.symbol, securities_panel.minor_axis)
+    # Normalize daily returns so one matrix product gives every correlation at once
+    returns = securities_prices.pct_change().iloc[1:].fillna(0).values
+    returns = (returns - returns.mean(axis=0)) / returns.std(axis=0)
+    correlation_matrix = returns.T.dot(returns) / len(returns)
+    
+    # A security is never its own candidate, nor is one without any price changes
+    correlation_matrix[np.isnan(correlation_matrix)] = -np.inf
+    np.fill_diagonal(correlation_matrix, -np.inf)
+    
+    # Only securities in the same sector/industry bucket can be candidates
+    if sectors is not None:
+        buckets = np.array([sectors.get(s) for s in securities_prices.columns], dtype=object)
+        correlation_matrix[buckets[:, None] != buckets[None, :]] = -np.inf
+    
+    neighbours = []
+    for i in range(n):
+        neighbours.append([int(j) for j in np.argsort(correlation_matrix[i])[::-1][:top_k]
+                           if np.isfinite(correlation_matrix[i, j])])
+    return neighbours
+
+# Finds candidate pairs worth testing for cointegration
+def find_candidate_pairs(securities_prices, sectors=None, top_k=top_candidates):
+    candidates = set()
+    for i, neighbours in enumerate(find_neighbours(securities_prices, sectors, top_k)):
+        for j in neighbours:
+            candidates.add((min(i, j), max(i, j)))
+                
+    return sorted(candidates)
+
+# Finds candidate baskets: each security together with [size]-1 of its most correlated securities
+def find_candidate_baskets(securities_prices, size=basket_size, sectors=None, top_k=top_candidates+2):
+    candidates = set()
+    for i, neighbours in enumerate(find_neighbours(securities_prices, sectors, top_k)):
+        for others in combinations(neighbours, size - 1):
+            candidates.add(tuple(sorted((i,) + others)))
+                
+    return sorted(candidates)
+
+# Johansen trace test (constant term, one lagged difference) on a stack of equally sized
+# baskets, shaped (baskets, days, securities). Every regression and eigen-decomposition
+# is done for all baskets at once. Returns the trace statistics, shaped (baskets, ranks),
+# and the cointegrating vector of the largest eigenvalue of each basket.
+def johansen_trace(basket_prices):
+    basket_prices = basket_prices - basket_prices.mean(axis=1, keepdims=True)
+    dx = np.diff(basket_prices, axis=1)
+    
+    # Regress out the lagged differences from the differences and the lagged levels
+    z = dx[:, :-1] - dx[:, :-1].mean(axis=1, keepdims=True)
+    dx = dx[:, 1:] - dx[:, 1:].mean(axis=1, keepdims=True)
+    lx = basket_prices[:, 1:-1] - basket_prices[:, 1:-1].mean(axis=1, keepdims=True)
+    zz = np.einsum('gti,gtj->gij', z, z)
+    r0 = dx - np.einsum('gti,gij->gtj', z, np.linalg.solve(zz, np.einsum('gti,gtj->gij', z, dx)))
+    rk = lx - np.einsum('gti,gij->gtj', z, np.linalg.solve(zz, np.einsum('gti,gtj->gij', z, lx)))
+    
+    # Solve the eigenvalue problem of every basket in one call
+    days = r0.shape[1]
+    skk = np.einsum('gti,gtj->gij', rk, rk) / days
+    sk0 = np.einsum('gti,gtj->gij', rk, r0) / days
+    s00 = np.einsum('gti,gtj->gij', r0, r0) / days
+    sig = np.matmul(sk0, np.linalg.solve(s00, np.transpose(sk0, (0, 2, 1))))
+    eigenvalues, eigenvectors = np.linalg.eig(np.linalg.solve(skk, sig))
+    eigenvalues = np.real(eigenvalues)
+    eigenvectors = np.real(eigenvectors)
+    
+    order = np.argsort(eigenvalues, axis=1)[:, ::-1]
+    eigenvalues = np.take_along_axis(eigenvalues, order, axis=1)
+    vectors = eigenvectors[np.arange(len(order)), :, order[:, 0]]
+    
+    # Trace statistic for each rank r: -T * sum(log(1 - eigenvalues[r:]))
+    logs = np.log(1 - eigenvalues)
+    trace_stats = -days * np.cumsum(logs[:, ::-1], axis=1)[:, ::-1]
+    return trace_stats, vectors
+
+# johansen_trace on one chunk of baskets. If the chunk fails as a whole (e.g. a basket with a
+# price that never moves), the baskets are tested one by one and the failing ones get NaN results.
+def johansen_trace_chunk(basket_prices):
+    try:
+        return johansen_trace(basket_prices)
+    except np.linalg.LinAlgError:
+        baskets, days, size = basket_prices.shape
+        trace_stats = np.full((baskets, size), np.nan)
+        vectors = np.full((baskets, size), np.nan)
+        for k in range(baskets):
+            try:
+                result = johansen_trace(basket_prices[k:k + 1])
+            except np.linalg.LinAlgError:
+                continue
+            trace_stats[k], vectors[k] = result[0][0], result[1][0]
+        return trace_stats, vectors
+
+# Finds cointegrated baskets of 3+ securities with Johansen tests, spread over all cores
+def find_cointegrated_baskets(securities_prices, candidates, processes=None, chunk_size=500):
+    values = securities_prices.values
+    baskets = []
+    
+    # Securities listed or delisted during the period can't be tested over the full history,
+    # so baskets holding any of them are skipped
+    complete = np.isfinite(values).all(axis=0)
+    candidates = [c for c in candidates if complete[list(c)].all()]
+    
+    # Baskets of the same size are stacked into one array, days along the middle axis
+    for size in sorted(set(len(c) for c in candidates)):
+        groups = np.array([c for c in candidates if len(c) == size])
+        stacked = np.transpose(values[:, groups], (1, 0, 2))
+        chunks = [stacked[k:k + chunk_size] for k in range(0, len(stacked), chunk_size)]
+        
+        pool = Pool(processes)
+        try:
+            results = pool.map(johansen_trace_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        trace_stats = np.concatenate([r[0] for r in results])
+        vectors = np.concatenate([r[1] for r in results])
+        
+        # Returns baskets cointegrated at 95% with their hedge ratios against the first security
+        with np.errstate(invalid='ignore'):
+            significant = trace_stats[:, 0] > johansen_trace_critical_values[size]
+        for group, vector in zip(groups[significant], vectors[significant]):
+            hedge = -vector[1:] / vector[0]
+            baskets.append((tuple(securities_prices.columns[group]), hedge))
+                
+    return baskets
+
+# Slope(s) and intercept of the OLS regression of Y on X, in closed form
+def ols_hedge_ratio(Y, X):
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
+    A = np.column_stack([np.ones(len(X)), X])
+    params = np.linalg.solve(A.T.dot(A), A.T.dot(np.asarray(Y, dtype=float)))
+    return params[1:], params[0]
 
 # Show a heatmap of the p-values of the cointegration tests between stock pairs.
 # Only stock pairs above the upper-diagonal shown to improve visibility.
-scores,pvalues, pairs = find_cointegrated_pairs(securities_panel)
+def plot_pvalues(pvalues, symbol_list):
+    import seaborn
+    
+    return seaborn.heatmap(pvalues, xticklabels=symbol_list, yticklabels=symbol_list, 
+                           cmap='RdYlGn_r', mask = (pvalues >= 0.95))
+
+# Reports how many of the exhaustively found pairs survive the prefilter
+def prefilter_recall(candidate_pairs, exhaustive_pairs, n):
+    found = len(set(candidate_pairs) & set(exhaustive_pairs))
+    recall = float(found) / len(exhaustive_pairs) if exhaustive_pairs else 1.0
+    reduction = (n * (n - 1) / 2.0) / max(len(candidate_pairs), 1)
+    return recall, reduction
+    
+# Notebook run (the research environment runs this file as __main__)
+if __name__ == '__main__':
+    # Create symbols array of oil companies and the S&P 500
+    symbol_list = ['XOM', 'BP', 'RDS-B', 'COP', 'MRO', 'PXD', 'STO', 'PZE', 'SHI', 'COG', 'CLR', 'CRZO', 'SPY']
+    securities_panel = get_pricing(symbol_list, fields=['price'], start_date=start_date, end_date=end_date)
+    securities_panel.minor_axis = map(lambda x: x.symbol, securities_panel.minor_axis)
+    securities_prices = securities_panel['price']
+
+    # Sector/industry bucket of each symbol, or None to bucket on correlation alone
+    # (all of these are oil companies, so only the S&P 500 would be separated anyway)
+    sector_map = None
+
+    # Only test the most correlated candidates of each security for cointegration
+    candidate_pairs = find_candidate_pairs(securities_prices, sectors=sector_map)
+    scores, pvalues, pairs = find_cointegrated_pairs(securities_prices, candidates=candidate_pairs)
+
+    # Compare against the exhaustive scan to choose a [top_candidates] that keeps the real pairs
+    if check_recall:
+        exhaustive_scores, exhaustive_pvalues, exhaustive_pairs = find_cointegrated_pairs(securities_prices)
+        exhaustive_indices = [(i, j) for i in range(len(symbol_list)) for j in range(i+1, len(symbol_list))
+                              if exhaustive_pvalues[i, j] < 0.05]
+        recall, reduction = prefilter_recall(candidate_pairs, exhaustive_indices, len(symbol_list))
+        print("Prefilter recall: " + str(recall) + ", " + str(len(candidate_pairs)) + " tests (" + str(reduction) + "x fewer)")
+
+    # Search baskets of [basket_size] securities among the most correlated securities of each security
+    candidate_baskets = find_candidate_baskets(securities_prices, sectors=sector_map)
+    baskets = find_cointegrated_baskets(securities_prices, candidate_baskets)
+    for (basket, hedge) in baskets:
+        print(str(basket) + " hedge ratios: " + str(hedge))
 
-seaborn.heatmap(pvalues, xticklabels=symbol_list, yticklabels=symbol_list, 
-                cmap='RdYlGn_r', mask = (pvalues >= 0.95))
-print pairs
+    plot_pvalues(pvalues, symbol_list)
+    print(pairs)
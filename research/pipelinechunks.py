@@ -0,0 +1,99 @@
+# Imports
+from multiprocessing.pool import ThreadPool
+import time
+import pandas as pd
+
+# Research environment
+
+# Pipeline results computed ahead of time in multi-day chunks, for local runs of the pipeline
+# algorithms (algo1, algo2). While the days of one chunk are consumed, the next chunk is
+# computed and split by date on a background thread, so a day's output is only a dictionary
+# lookup. In a local run, before_trading_start replaces
+#   context.output = algo.pipeline_output('pipeline')
+# with
+#   context.output = context.pipeline.output(get_datetime())
+# where context.pipeline = ChunkedPipeline(make_pipeline(), start, end) is created once.
+
+# Select a time range and the trading days each pipeline computation covers
+period_start = pd.Timestamp('2016-01-04')
+period_end = pd.Timestamp('2016-12-30')
+chunk_days = 126
+
+# Day a timestamp falls on, as the tz-naive midnight used for lookups
+def session_day(date):
+    date = pd.Timestamp(date)
+    if date.tz is not None:
+        date = date.tz_convert('UTC').tz_localize(None)
+    return date.normalize()
+
+class ChunkedPipeline(object):
+    # [run_pipeline] is called as run_pipeline(pipeline, start, end) and defaults to the
+    # research environment's. Pass e.g. a zipline engine's run_pipeline for other data.
+    def __init__(self, pipeline, start_date, end_date, chunk_days=chunk_days, run_pipeline=None):
+        if run_pipeline is None:
+            from quantopian.research import run_pipeline
+        self.pipeline = pipeline
+        self.run_pipeline = run_pipeline
+
+        # (first day, last day) of every chunk, holidays are skipped by the pipeline itself
+        days = pd.bdate_range(session_day(start_date), session_day(end_date))
+        self.chunks = [(days[i], days[min(i + chunk_days, len(days)) - 1])
+                       for i in range(0, len(days), chunk_days)]
+        self.next_chunk = 0
+        self.chunk_end = None
+        self.frames = {}
+        self.columns = None
+
+        # A single worker, so chunks are computed in order and one ahead of the simulation
+        self.pool = ThreadPool(1)
+        self.pending = None
+        self.prefetch()
+
+    # Computes one chunk and splits it into one frame per day, indexed by asset
+    def compute(self, start, end):
+        results = self.run_pipeline(self.pipeline, start, end)
+        frames = dict((session_day(date), frame.reset_index(level=0, drop=True))
+                      for (date, frame) in results.groupby(level=0))
+        return frames, results.columns
+
+    # Starts computing the next chunk on the worker
+    def prefetch(self):
+        if self.next_chunk < len(self.chunks):
+            (start, end) = self.chunks[self.next_chunk]
+            self.pending = (end, self.pool.apply_async(self.compute, (start, end)))
+            self.next_chunk += 1
+        else:
+            self.pending = None
+
+    # Pipeline output of one day, moving on to later chunks (and prefetching the one after)
+    # as the days pass. Days must be requested in order, like before_trading_start does.
+    def output(self, date):
+        day = session_day(date)
+        while self.chunk_end is None or day > self.chunk_end:
+            if self.pending is None:
+                raise ValueError('No pipeline chunk covers ' + str(day.date()))
+            (self.chunk_end, result) = self.pending
+            (self.frames, self.columns) = result.get()
+            self.prefetch()
+
+        if day in self.frames:
+            return self.frames[day]
+        return pd.DataFrame(columns=self.columns)
+
+    # Stops the worker once the run is over
+    def close(self):
+        self.pool.terminate()
+
+if __name__ == '__main__':
+    from quantopian.pipeline.experimental import risk_loading_pipeline
+
+    # Consume a year of risk loadings day by day, timing how long the lookups wait
+    pipeline = ChunkedPipeline(risk_loading_pipeline(), period_start, period_end)
+    waited = 0.0
+    days = pd.bdate_range(period_start, period_end)
+    for day in days:
+        start = time.time()
+        output = pipeline.output(day)
+        waited += time.time() - start
+    pipeline.close()
+    print("Waited " + str(waited) + "s for pipeline output over " + str(len(days)) + " days")
@@ -0,0 +1,107 @@
+# Imports
+import fcntl
+import os
+import numpy as np
+import pandas as pd
+
+# Research environment
+
+# Daily risk-model loadings (assets x sector/style factors) cached as one float32
+# .npy file per date. Every date shares the same asset index, so separate processes
+# backtesting against the same risk model can memory-map the same files instead of
+# each computing and holding its own copy.
+
+# Select the cache location and the time range to fill it with
+cache_dir = 'risk_loadings'
+period_start = pd.Timestamp('2016-01-04')
+period_end = pd.Timestamp('2016-12-30')
+
+# Path of the partition holding one date's loadings
+def partition_path(cache_dir, date):
+    return os.path.join(cache_dir, pd.Timestamp(date).strftime('%Y-%m-%d') + '.npy')
+
+# Writes an array so readers in other processes never see a half written file
+def atomic_save(path, array):
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.rename(tmp_path, path)
+
+# Same as atomic_save, for a text file
+def atomic_save_text(path, text):
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.rename(tmp_path, path)
+
+# Returns the shared asset index (sids) and factor names, or empty ones for a new cache
+def read_index(cache_dir):
+    assets_path = os.path.join(cache_dir, 'assets.npy')
+    factors_path = os.path.join(cache_dir, 'factors.txt')
+    if not os.path.exists(assets_path):
+        return np.array([], dtype=np.int64), []
+    with open(factors_path) as f:
+        factors = f.read().split()
+    return np.load(assets_path), factors
+
+# Stores each date of a risk loadings pipeline result in the cache
+def cache_risk_loadings(cache_dir, loadings):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    sids = np.array([asset.sid for asset in loadings.index.get_level_values(1)], dtype=np.int64)
+
+    # Writers in other processes may be appending to the index too, so it is re-read and
+    # updated while holding the cache's lock
+    with open(os.path.join(cache_dir, 'index.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            assets, factors = read_index(cache_dir)
+            if not factors:
+                factors = list(loadings.columns)
+                atomic_save_text(os.path.join(cache_dir, 'factors.txt'), '\n'.join(factors))
+
+            # New assets are only ever appended, so rows of existing partitions stay valid
+            new_sids = np.setdiff1d(np.unique(sids), assets)
+            if len(new_sids):
+                assets = np.concatenate([assets, new_sids])
+                atomic_save(os.path.join(cache_dir, 'assets.npy'), assets)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    positions = pd.Series(np.arange(len(assets)), index=assets)
+
+    # One float32 matrix per date, NaN for assets without loadings that day
+    values = loadings[factors].values.astype(np.float32)
+    dates = loadings.index.get_level_values(0)
+    for date in dates.unique():
+        rows = np.asarray(dates == date)
+        partition = np.full((len(assets), len(factors)), np.nan, dtype=np.float32)
+        partition[positions[sids[rows]].values] = values[rows]
+        atomic_save(partition_path(cache_dir, date), partition)
+
+# Memory-maps one date's loadings as a dataframe indexed by sid (no copy is made)
+def load_risk_loadings(cache_dir, date):
+    assets, factors = read_index(cache_dir)
+    partition = np.load(partition_path(cache_dir, date), mmap_mode='r')
+
+    # Partitions written before later assets were appended are shorter than the index
+    return pd.DataFrame(partition, index=assets[:len(partition)], columns=factors, copy=False)
+
+# Deletes every cached date between start and end (inclusive) to bound disk use
+def evict_risk_loadings(cache_dir, start, end):
+    evicted = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.npy') or name == 'assets.npy':
+            continue
+        date = pd.Timestamp(name[:-len('.npy')])
+        if pd.Timestamp(start) <= date <= pd.Timestamp(end):
+            os.remove(os.path.join(cache_dir, name))
+            evicted.append(date)
+    return sorted(evicted)
+
+if __name__ == '__main__':
+    from quantopian.pipeline.experimental import risk_loading_pipeline
+    from quantopian.research import run_pipeline
+
+    # Fill the cache, then show the loadings of the first day
+    cache_risk_loadings(cache_dir, run_pipeline(risk_loading_pipeline(), period_start, period_end))
+    print(load_risk_loadings(cache_dir, period_start).dropna().head())
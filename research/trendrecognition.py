@@ -2,6 +2,7 @@
 from quantopian.research import prices, symbols
 from quantopian.pipeline.factors import SimpleMovingAverage
 
+from multiprocessing import Pool
 import pandas as pd
 import datetime
 
@@ -15,109 +16,157 @@ period_end = pd.Timestamp('2015-12-31')
 # Top choices: GOOG and GLD both perform well
 stock_symbol = 'QQQ'
 
+# Select the securities to screen in batch mode (empty to skip the batch run)
+batch_symbols = []
+
+# Fewest days of prices a security needs to be backtested
+min_history = 6
+
+# Finds the extrema, their trends and the resulting orders for one security's prices
+def trend_backtest(stock_close):
+    extremadataframe = pd.DataFrame({
+        'price': [],
+        'type': [],
+        'trend': [],
+        }, index=[])
+    orders = pd.DataFrame({
+        'type': [],
+        'prev_exitgain': [],
+        'marker': []
+        }, index=[])
+    increasing = False
+    decreasing = False
+
+    for date in stock_close.index:
+        if date == stock_close.index[1] or date == stock_close.index[0]:
+            previousdate=date
+            continue
+        if stock_close[date] < stock_close[previousdate]:
+            if increasing:
+                extremadataframe = pd.concat([pd.DataFrame({
+                    'price': [stock_close[previousdate]],
+                    'type': ['maximum'],
+                    'trend': ['incomplete']
+                }, index=[previousdate]), extremadataframe],
+                         axis=0,join='outer')
+                if date > stock_close.index[5]:
+                    if ((extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] < extremadataframe['price'].shift(-2).loc[pd.Timestamp(previousdate, tz='UTC')]) and 
+                   (extremadataframe['price'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] < extremadataframe['price'].shift(-3).loc[pd.Timestamp(previousdate, tz='UTC')])):
+                        extremadataframe.at[pd.Timestamp(previousdate, tz='UTC'),'trend']='down'
+                        # Currently using extrema but in real algorithm should enter position when any point
+                        # Goes above the previous trend bracket (previous high or previous low)
+                        if (extremadataframe[extremadataframe['trend'] != 'incomplete']['trend'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] == 'up'):
+                            orders = pd.concat([pd.DataFrame({
+                                'type': ['short'],
+                                'prev_exitgain': [0],
+                                'marker': 166
+                            }, index=[previousdate]), orders],
+                                 axis=0,join='outer')
+                            if (previousdate > orders.iloc[-1].name):
+                                orders.at[pd.Timestamp(previousdate, tz='UTC'), 'prev_exitgain'] = extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] - extremadataframe['price'].loc[orders.iloc[orders.index.get_loc(pd.Timestamp(previousdate, tz='UTC'))+1].name]
+                    if ((extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] > extremadataframe['price'].shift(-2).loc[pd.Timestamp(previousdate, tz='UTC')]) and 
+                   (extremadataframe['price'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] > extremadataframe['price'].shift(-3).loc[pd.Timestamp(previousdate, tz='UTC')])):
+                        extremadataframe.at[pd.Timestamp(previousdate, tz='UTC'),'trend']='up'
+                        # Currently using extrema but in real algorithm should enter position when any point
+                        # Goes above the previous trend bracket (previous high or previous low)
+                        if (extremadataframe[extremadataframe['trend'] != 'incomplete']['trend'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] == 'down'):
+                            orders = pd.concat([pd.DataFrame({
+                                'type': ['long'],
+                                'prev_exitgain': [0],
+                                'marker': 162
+                            }, index=[previousdate]), orders],
+                                 axis=0,join='outer')
+                            if (previousdate > orders.iloc[-1].name):
+                                orders.at[pd.Timestamp(previousdate, tz='UTC'), 'prev_exitgain'] = -1 * (extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] - extremadataframe['price'].loc[orders.iloc[orders.index.get_loc(pd.Timestamp(previousdate, tz='UTC'))+1].name])
+            increasing = False
+            decreasing = True
+        elif stock_close[date] > stock_close[previousdate]:
+            if decreasing:
+                extremadataframe = pd.concat([pd.DataFrame({
+                    'price': [stock_close[previousdate]],
+                    'type': ['minimum'],
+                    'trend': ['incomplete']
+                }, index=[previousdate]), extremadataframe],
+                         axis=0,join='outer')
+                if date > stock_close.index[5]:
+                    if ((extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] < extremadataframe['price'].shift(-2).loc[pd.Timestamp(previousdate, tz='UTC')]) and 
+                   (extremadataframe['price'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] < extremadataframe['price'].shift(-3).loc[pd.Timestamp(previousdate, tz='UTC')])):
+                        extremadataframe.at[pd.Timestamp(previousdate, tz='UTC'),'trend']='down'
+                        # Currently using extrema but in real algorithm should enter position when any point
+                        # Goes above the previous trend bracket (previous high or previous low)
+                        if (extremadataframe[extremadataframe['trend'] != 'incomplete']['trend'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] == 'up'):
+                            orders = pd.concat([pd.DataFrame({
+                                'type': ['short'],
+                                'prev_exitgain': [0],
+                                'marker': 166
+                            }, index=[previousdate]), orders],
+                                 axis=0,join='outer')
+                            if (previousdate > orders.iloc[-1].name):
+                                orders.at[pd.Timestamp(previousdate, tz='UTC'), 'prev_exitgain'] = extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] - extremadataframe['price'].loc[orders.iloc[orders.index.get_loc(pd.Timestamp(previousdate, tz='UTC'))+1].name]
+                    if ((extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] > extremadataframe['price'].shift(-2).loc[pd.Timestamp(previousdate, tz='UTC')]) and 
+                   (extremadataframe['price'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] > extremadataframe['price'].shift(-3).loc[pd.Timestamp(previousdate, tz='UTC')])):
+                        extremadataframe.at[pd.Timestamp(previousdate, tz='UTC'),'trend']='up'
+                        # Currently using extrema but in real algorithm should enter position when any point
+                        # Goes above the previous trend bracket (previous high or previous low)
+                        if (extremadataframe[extremadataframe['trend'] != 'incomplete']['trend'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] == 'down'):
+                            orders = pd.concat([pd.DataFrame({
+                                'type': ['long'],
+                                'prev_exitgain': [0],
+                                'marker': 162
+                            }, index=[previousdate]), orders],
+                                 axis=0,join='outer')
+                            if (previousdate > orders.iloc[-1].name):
+                                orders.at[pd.Timestamp(previousdate, tz='UTC'), 'prev_exitgain'] = -1 * (extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] - extremadataframe['price'].loc[orders.iloc[orders.index.get_loc(pd.Timestamp(previousdate, tz='UTC'))+1].name])
+            increasing = True
+            decreasing = False
+        
+        previousdate = date
+
+    return extremadataframe, orders
+
+# Summarizes the orders of one security's backtest (used by the batch process pool)
+def trend_summary(stock_close):
+    # trend_backtest needs at least 6 days (new listings and delistings may have fewer)
+    if len(stock_close) < min_history:
+        return pd.Series({'total_gain': float('nan'), 'trade_count': 0, 'hit_rate': float('nan')},
+                         name=stock_close.name)
+    
+    extremadataframe, orders = trend_backtest(stock_close)
+    
+    # Every order but the first closes the previous one with [prev_exitgain]
+    closed_trades = max(len(orders) - 1, 0)
+    hits = (orders['prev_exitgain'] > 0).sum()
+    return pd.Series({
+        'total_gain': orders['prev_exitgain'].sum(),
+        'trade_count': len(orders),
+        'hit_rate': float(hits) / closed_trades if closed_trades else float('nan')
+    }, name=stock_close.name)
+
+# Runs the backtest on every symbol in parallel from a single bulk pricing read
+def batch_trend_backtest(symbol_list, start, end, processes=None):
+    batch_close = prices(
+        assets=symbols(symbol_list),
+        start=start,
+        end=end
+    )
+    
+    # Name each column by its ticker so the results table is readable
+    batch_close.columns = [asset.symbol for asset in batch_close.columns]
+    
+    pool = Pool(processes)
+    try:
+        results = pool.map(trend_summary, [batch_close[s].dropna() for s in batch_close.columns])
+    finally:
+        pool.close()
+        pool.join()
+    return pd.DataFrame(results)[['total_gain', 'trade_count', 'hit_rate']]
+
 stock_close = prices(
     assets=symbols(stock_symbol),
     start=period_start,
     end=period_end
 )
-
-extremadataframe = pd.DataFrame({
-    'price': [],
-    'type': [],
-    'trend': [],
-    }, index=[])
-orders = pd.DataFrame({
-    'type': [],
-    'prev_exitgain': [],
-    'marker': []
-    }, index=[])
-increasing = False
-decreasing = False
-
-for date in stock_close.index:
-    if date == stock_close.index[1] or date == stock_close.index[0]:
-        previousdate=date
-        continue
-    if stock_close[date] < stock_close[previousdate]:
-        if increasing:
-            extremadataframe = pd.concat([pd.DataFrame({
-                'price': [stock_close[previousdate]],
-                'type': ['maximum'],
-                'trend': ['incomplete']
-            }, index=[previousdate]), extremadataframe],
-                     axis=0,join='outer')
-            if date > stock_close.index[5]:
-                if ((extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] < extremadataframe['price'].shift(-2).loc[pd.Timestamp(previousdate, tz='UTC')]) and 
-               (extremadataframe['price'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] < extremadataframe['price'].shift(-3).loc[pd.Timestamp(previousdate, tz='UTC')])):
-                    extremadataframe.at[pd.Timestamp(previousdate, tz='UTC'),'trend']='down'
-                    # Currently using extrema but in real algorithm should enter position when any point
-                    # Goes above the previous trend bracket (previous high or previous low)
-                    if (extremadataframe[extremadataframe['trend'] != 'incomplete']['trend'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] == 'up'):
-                        orders = pd.concat([pd.DataFrame({
-                            'type': ['short'],
-                            'prev_exitgain': [0],
-                            'marker': 166
-                        }, index=[previousdate]), orders],
-                             axis=0,join='outer')
-                        if (previousdate > orders.iloc[-1].name):
-                            orders.at[pd.Timestamp(previousdate, tz='UTC'), 'prev_exitgain'] = extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] - extremadataframe['price'].loc[orders.iloc[orders.index.get_loc(pd.Timestamp(previousdate, tz='UTC'))+1].name]
-                if ((extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] > extremadataframe['price'].shift(-2).loc[pd.Timestamp(previousdate, tz='UTC')]) and 
-               (extremadataframe['price'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] > extremadataframe['price'].shift(-3).loc[pd.Timestamp(previousdate, tz='UTC')])):
-                    extremadataframe.at[pd.Timestamp(previousdate, tz='UTC'),'trend']='up'
-                    # Currently using extrema but in real algorithm should enter position when any point
-                    # Goes above the previous trend bracket (previous high or previous low)
-                    if (extremadataframe[extremadataframe['trend'] != 'incomplete']['trend'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] == 'down'):
-                        orders = pd.concat([pd.DataFrame({
-                            'type': ['long'],
-                            'prev_exitgain': [0],
-                            'marker': 162
-                        }, index=[previousdate]), orders],
-                             axis=0,join='outer')
-                        if (previousdate > orders.iloc[-1].name):
-                            orders.at[pd.Timestamp(previousdate, tz='UTC'), 'prev_exitgain'] = -1 * (extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] - extremadataframe['price'].loc[orders.iloc[orders.index.get_loc(pd.Timestamp(previousdate, tz='UTC'))+1].name])
-        increasing = False
-        decreasing = True
-    elif stock_close[date] > stock_close[previousdate]:
-        if decreasing:
-            extremadataframe = pd.concat([pd.DataFrame({
-                'price': [stock_close[previousdate]],
-                'type': ['minimum'],
-                'trend': ['incomplete']
-            }, index=[previousdate]), extremadataframe],
-                     axis=0,join='outer')
-            if date > stock_close.index[5]:
-                if ((extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] < extremadataframe['price'].shift(-2).loc[pd.Timestamp(previousdate, tz='UTC')]) and 
-               (extremadataframe['price'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] < extremadataframe['price'].shift(-3).loc[pd.Timestamp(previousdate, tz='UTC')])):
-                    extremadataframe.at[pd.Timestamp(previousdate, tz='UTC'),'trend']='down'
-                    # Currently using extrema but in real algorithm should enter position when any point
-                    # Goes above the previous trend bracket (previous high or previous low)
-                    if (extremadataframe[extremadataframe['trend'] != 'incomplete']['trend'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] == 'up'):
-                        orders = pd.concat([pd.DataFrame({
-                            'type': ['short'],
-                            'prev_exitgain': [0],
-                            'marker': 166
-                        }, index=[previousdate]), orders],
-                             axis=0,join='outer')
-                        if (previousdate > orders.iloc[-1].name):
-                            orders.at[pd.Timestamp(previousdate, tz='UTC'), 'prev_exitgain'] = extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] - extremadataframe['price'].loc[orders.iloc[orders.index.get_loc(pd.Timestamp(previousdate, tz='UTC'))+1].name]
-                if ((extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] > extremadataframe['price'].shift(-2).loc[pd.Timestamp(previousdate, tz='UTC')]) and 
-               (extremadataframe['price'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] > extremadataframe['price'].shift(-3).loc[pd.Timestamp(previousdate, tz='UTC')])):
-                    extremadataframe.at[pd.Timestamp(previousdate, tz='UTC'),'trend']='up'
-                    # Currently using extrema but in real algorithm should enter position when any point
-                    # Goes above the previous trend bracket (previous high or previous low)
-                    if (extremadataframe[extremadataframe['trend'] != 'incomplete']['trend'].shift(-1).loc[pd.Timestamp(previousdate, tz='UTC')] == 'down'):
-                        orders = pd.concat([pd.DataFrame({
-                            'type': ['long'],
-                            'prev_exitgain': [0],
-                            'marker': 162
-                        }, index=[previousdate]), orders],
-                             axis=0,join='outer')
-                        if (previousdate > orders.iloc[-1].name):
-                            orders.at[pd.Timestamp(previousdate, tz='UTC'), 'prev_exitgain'] = -1 * (extremadataframe['price'].loc[pd.Timestamp(previousdate, tz='UTC')] - extremadataframe['price'].loc[orders.iloc[orders.index.get_loc(pd.Timestamp(previousdate, tz='UTC'))+1].name])
-        increasing = True
-        decreasing = False
-        
-    previousdate = date
+extremadataframe, orders = trend_backtest(stock_close)
 
 pd.DataFrame({
     stock_symbol: stock_close,
@@ -128,3 +177,7 @@ pd.DataFrame({
 }).plot(style=['-', '^', 'v'], markersize=10)
 
 print("Total gain: $" + str(orders['prev_exitgain'].sum()))
+
+# Screen the whole list in one run, one row per symbol
+if batch_symbols:
+    print(batch_trend_backtest(batch_symbols, period_start, period_end).sort_values('total_gain', ascending=False))